@@ -1,43 +1,394 @@
+# Patch the standard library for cooperative I/O before anything else is
+# imported, so sockets, threads and queues all yield to the gevent loop.
+from gevent import monkey
+monkey.patch_all()
+
 import os
-import io
-import json
-from flask import Flask, render_template_string, request, send_file
+import gzip
+import hashlib
+import logging
+import orjson
+import shutil
+import tempfile
+import threading
+import time
+import unicodedata
+from urllib.parse import quote, unquote
+from flask import Flask, request, Response, send_file
 from flask_sock import Sock
-import random
-import string
+import secrets
+
+# Redis is only needed for multi-worker deployments; keep it optional so a
+# plain `python app.py` still works without it installed.
+try:
+    import redis as _redis_lib
+except ImportError:
+    _redis_lib = None
 
 # Initialize the Flask app and the Sock extension for WebSocket support
 app = Flask(__name__)
 sock = Sock(app)
 
-# A dictionary to store active sharing "rooms"
-# Each key is a unique code. The value is a dictionary containing
-# websocket connections and file data.
-# Format: { 'CODE': {'sender': ws, 'receiver': ws, 'filename': name, 'file_data': data} }
+# Per-event chatter is logged at DEBUG so it costs nothing at the default
+# INFO level; print() flushed stdout (and took its lock) on every WS event.
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Size of the chunks read off the upload stream. 512 KiB keeps the read
+# loop cheap while staying large enough to saturate the socket.
+CHUNK_SIZE = 512 * 1024
+
+# Uploads above this size are written to a tmpfile instead of RAM, so one
+# big transfer cannot eat the process's memory. Small files keep the fast
+# in-memory path. The directory should sit on fast local storage.
+SPILL_THRESHOLD = 16 * 1024 * 1024
+SPILL_DIR = os.environ.get('PEERDROP_SPILL_DIR', '/var/tmp')
+
+# When running behind nginx, set this to an internal location that aliases
+# SPILL_DIR, e.g.
+#     location /internal_files/ { internal; alias /var/tmp/; }
+# and PEERDROP_ACCEL_PREFIX=/internal_files. /download then answers with an
+# X-Accel-Redirect header and nginx streams the file via kernel sendfile —
+# the Python process never touches the payload.
+ACCEL_PREFIX = os.environ.get('PEERDROP_ACCEL_PREFIX')
+
+class Room:
+    """Per-code transfer state.
+
+    __slots__ pins each room to a fixed C-level struct — no per-instance
+    dict, a fraction of the memory, and attribute access by slot index
+    rather than a hash lookup on every WS event.
+    """
+    __slots__ = ('sender', 'receiver', 'filename', 'file_data', 'file_size',
+                 'buf_cls', 'buf_refs', 'dropped', 'file_path', 'created')
+
+    def __init__(self, sender=None):
+        self.sender = sender
+        self.receiver = None
+        self.filename = None
+        # The uploaded file lives either in an in-memory buffer (file_data)
+        # or as a spilled tmpfile on disk (file_path). Pooled buffers are
+        # sized up to their class, so file_size tracks the real length and
+        # buf_cls the class to return the buffer to on cleanup. buf_refs
+        # counts download responses currently streaming the buffer, and
+        # dropped records that the room was torn down while one was live.
+        self.file_data = None
+        self.file_size = 0
+        self.buf_cls = None
+        self.buf_refs = 0
+        self.dropped = False
+        self.file_path = None
+        self.created = time.monotonic()
+
+
+# Active sharing rooms, keyed by their unique code
 rooms = {}
 
-def generate_code(length=5):
-    """Generates a unique random code for a room."""
+# Upload buffers are recycled through a small pool of power-of-two size
+# classes instead of allocating a fresh multi-MB bytearray per transfer,
+# which thrashed the allocator (and left glibc holding arenas) under
+# churn. The largest class matches SPILL_THRESHOLD; anything bigger goes
+# to disk anyway.
+_POOL_CLASSES = (1 << 20, 1 << 22, 1 << 24)  # 1 MiB, 4 MiB, 16 MiB
+_POOL_MAX_PER_CLASS = 4
+_buffer_pool = {cls: [] for cls in _POOL_CLASSES}
+_pool_lock = threading.Lock()
+
+
+def _acquire_buffer(size):
+    """Returns (buf, cls) with a buffer of at least `size` bytes.
+
+    Reuses a pooled buffer from the smallest fitting size class when one
+    is available; cls is None for odd sizes above every class, in which
+    case the buffer is not pooled.
+    """
+    for cls in _POOL_CLASSES:
+        if cls >= size:
+            with _pool_lock:
+                if _buffer_pool[cls]:
+                    return _buffer_pool[cls].pop(), cls
+            return bytearray(cls), cls
+    return bytearray(size), None
+
+
+def _release_buffer(buf, cls):
+    """Returns a buffer to its size class if the pool has room for it."""
+    if cls is None:
+        return
+    with _pool_lock:
+        if len(_buffer_pool[cls]) < _POOL_MAX_PER_CLASS:
+            _buffer_pool[cls].append(buf)
+
+# When REDIS_URL is set, room codes are registered in Redis so they stay
+# unique across workers and peer notifications travel over pub/sub. The
+# file itself only ever lives on the worker that owns the sender's
+# connection, so a receiver may only join a room that is local to its own
+# worker — a cross-worker pair is refused at join time (with a distinct
+# error) rather than left to fail mid-transfer at /upload or /download.
+REDIS_URL = os.environ.get('REDIS_URL')
+redis_client = _redis_lib.from_url(REDIS_URL) if _redis_lib and REDIS_URL else None
+ROOM_KEY_TTL = 3600  # Seconds before an abandoned code expires from Redis
+
+
+# Pre-serialized constant messages for the WebSocket hot path. These
+# payloads never change, so encoding them on every send just re-ran the
+# serializer over the same literal dicts. orjson emits bytes, which go
+# out as binary frames; the client decodes them before JSON.parse.
+MSG_RECEIVER_JOINED = orjson.dumps({'type': 'receiver_joined'})
+MSG_WAITING_FOR_FILE = orjson.dumps({'type': 'wating_for_file'})
+ERR_INVALID_CODE = orjson.dumps({'type': 'error', 'message': 'Invalid or expired code.'})
+ERR_ROOM_ELSEWHERE = orjson.dumps({'type': 'error', 'message': 'Room is on another server. Please reconnect and try again.'})
+ERR_SENDER_DISCONNECTED = orjson.dumps({'type': 'error', 'message': 'Sender disconnected.'})
+ERR_RECEIVER_DISCONNECTED = orjson.dumps({'type': 'error', 'message': 'Receiver disconnected.'})
+
+
+def _room_key(code):
+    return f'room:{code}'
+
+
+def _events_channel(code, role):
+    return f'room:{code}:events:{role}'
+
+
+def _room_exists(code):
+    """Checks the local dict first, then Redis for rooms on other workers."""
+    if code in rooms:
+        return True
+    return bool(redis_client and redis_client.exists(_room_key(code)))
+
+
+def _send_to_peer(code, role, message):
+    """Delivers a serialized message to the room's sender or receiver.
+
+    With Redis enabled the message is published on the room's per-role
+    channel and the owning worker's forwarder pushes it down the right
+    WebSocket; otherwise it goes straight to the local handle. `message`
+    is already JSON-encoded bytes, so the cached constants above are
+    relayed as-is with no re-encoding or wrapper on either side. Returns
+    True if the message was handed off.
+    """
+    if redis_client:
+        redis_client.publish(_events_channel(code, role), message)
+        return True
+    room = rooms.get(code)
+    peer_ws = getattr(room, role) if room else None
+    if peer_ws:
+        peer_ws.send(message)
+        return True
+    return False
+
+
+def _forward_events(pubsub, ws):
+    """Relays events published for this peer's role to its local WebSocket."""
+    try:
+        for msg in pubsub.listen():
+            if msg['type'] == 'message':
+                ws.send(msg['data'])
+    except Exception:
+        pass  # Socket is gone; the WS handler's cleanup closes the room.
+
+
+def _iter_buffer(mv, chunk_size=64 * 1024):
+    """Yields fixed-size windows over a memoryview without copying it."""
+    for offset in range(0, len(mv), chunk_size):
+        yield mv[offset:offset + chunk_size]
+
+
+def _set_attachment_header(resp, filename):
+    """Sets Content-Disposition the way send_file does.
+
+    Headers can only carry latin-1, so a hand-built f-string 500s in
+    start_response for e.g. CJK filenames. Non-ASCII names get an ASCII
+    fallback plus the RFC 5987 filename* parameter; Werkzeug's header
+    serializer also quotes any embedded '"' for us.
+    """
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename)
+        simple = simple.encode('ascii', 'ignore').decode('ascii')
+        quoted = quote(filename, safe="!#$&+-.^_`|~")
+        resp.headers.set('Content-Disposition', 'attachment', filename=simple,
+                         **{'filename*': f"UTF-8''{quoted}"})
+    else:
+        resp.headers.set('Content-Disposition', 'attachment',
+                         filename=filename)
+
+
+def _stream_room_buffer(room):
+    """Yields the room's buffer in zero-copy slices for one response.
+
+    The buffer may only go back to the pool once nothing is reading it:
+    a recycled bytearray can be overwritten by the next upload while a
+    still-streaming response yields slices of it (writing into a bytearray
+    with live memoryview exports is legal — only resizing raises). Each
+    response counts itself in buf_refs, and whichever of the last response
+    or _drop_room finishes second performs the actual release.
+    """
+    room.buf_refs += 1
+    try:
+        yield from _iter_buffer(memoryview(room.file_data)[:room.file_size])
+    finally:
+        room.buf_refs -= 1
+        if room.dropped and room.buf_refs == 0 and room.file_data is not None:
+            _release_buffer(room.file_data, room.buf_cls)
+            room.file_data = None
+
+
+def _drop_room(code):
+    """Removes a room and releases its file buffer or spilled tmpfile."""
+    room = rooms.pop(code, None)
+    if room and room.file_path:
+        try:
+            os.unlink(room.file_path)
+        except OSError:
+            pass # Already gone
+    if room:
+        room.dropped = True
+        # Defer the release to the last streaming response if one is live
+        if room.file_data is not None and room.buf_refs == 0:
+            _release_buffer(room.file_data, room.buf_cls)
+            room.file_data = None
+    if redis_client:
+        redis_client.delete(_room_key(code))
+    return room
+
+
+# Rooms are normally torn down when their WebSocket closes, but if a
+# connection dies without reaching that cleanup (e.g. the worker is killed
+# mid-transfer) the entry — and its buffer or tmpfile — would leak until
+# restart. A background reaper drops anything older than ROOM_TTL.
+ROOM_TTL = 600        # Seconds a room may live before it is reaped
+SWEEP_INTERVAL = 30   # Seconds between reaper passes
+
+
+def _reap_rooms():
     while True:
-        # Generate a random uppercase alphanumeric code
-        code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
-        # Ensure the code is not already in use
-        if code not in rooms:
-            return code
+        time.sleep(SWEEP_INTERVAL)
+        cutoff = time.monotonic() - ROOM_TTL
+        for code, room in list(rooms.items()):
+            if room.created < cutoff:
+                _drop_room(code)
+                logger.debug("Reaped stale room %s", code)
+
+
+threading.Thread(target=_reap_rooms, daemon=True).start()
+
+def generate_code():
+    """Generates a unique random code for a room."""
+    # Three CSPRNG bytes give a 6-char hex code. With the handful of rooms
+    # alive at any moment a collision is vanishingly unlikely, so a single
+    # existence check (local dict plus Redis) is enough in practice.
+    code = secrets.token_hex(3).upper()
+    return code if not _room_exists(code) else generate_code()
 
 @app.route('/')
 def index():
     """Serves the main HTML page."""
-    # The entire frontend is contained within this HTML string
-    return render_template_string(HTML_TEMPLATE)
+    # The page has no template variables, so it is encoded and gzipped once
+    # at import time (see below HTML_TEMPLATE); no Jinja work per request.
+    if request.headers.get('If-None-Match') == _HTML_ETAG:
+        return Response(status=304, headers={'ETag': _HTML_ETAG})
+
+    headers = {
+        'ETag': _HTML_ETAG,
+        'Cache-Control': 'public, max-age=3600',
+        'Vary': 'Accept-Encoding'
+    }
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        headers['Content-Encoding'] = 'gzip'
+        return Response(_HTML_GZ, mimetype='text/html', headers=headers)
+    return Response(_HTML_BYTES, mimetype='text/html', headers=headers)
+
+class ConnState:
+    """Registration state for one WebSocket connection.
+
+    Passed to the message handlers so they can record which room and role
+    the connection ends up with; the cleanup path reads it back.
+    """
+    __slots__ = ('code', 'role', 'pubsub')
+
+    def __init__(self):
+        self.code = None
+        self.role = None
+        self.pubsub = None
+
+
+def _subscribe(ws, state):
+    """Starts forwarding this room's Redis events to the local WebSocket."""
+    if not redis_client:
+        return
+    state.pubsub = redis_client.pubsub()
+    state.pubsub.subscribe(_events_channel(state.code, state.role))
+    threading.Thread(
+        target=_forward_events, args=(state.pubsub, ws), daemon=True
+    ).start()
+
+
+def _handle_register_sender(ws, message, state):
+    """Creates a room for a sender and returns its code."""
+    state.role = 'sender'
+    state.code = generate_code()
+    rooms[state.code] = Room(sender=ws)
+    # Advertise the code to other workers and listen for events
+    if redis_client:
+        redis_client.hset(_room_key(state.code), 'open', 1)
+        redis_client.expire(_room_key(state.code), ROOM_KEY_TTL)
+    _subscribe(ws, state)
+    # Send the generated code back to the sender's browser
+    ws.send(orjson.dumps({'type': 'code_generated', 'code': state.code}))
+    logger.debug("Sender registered with code: %s", state.code)
+
+
+def _handle_register_receiver(ws, message, state):
+    """Joins a receiver to an existing room by its code."""
+    code = message.get('code', '').upper()
+    if redis_client:
+        # The file only ever lives on the worker that owns the sender's
+        # connection, so a receiver landing elsewhere could join but never
+        # upload/download. Refuse that pairing up front with its own error
+        # instead of 400ing mid-transfer; the hsetnx still marks the slot
+        # taken for every worker once a local join succeeds.
+        if code not in rooms and _room_exists(code):
+            ws.send(ERR_ROOM_ELSEWHERE)
+            return
+        joined = (code in rooms and not rooms[code].receiver and
+                  redis_client.hsetnx(_room_key(code), 'receiver', 1))
+    else:
+        joined = code in rooms and not rooms[code].receiver
+
+    if joined:
+        state.role = 'receiver'
+        state.code = code
+        if code in rooms:
+            rooms[code].receiver = ws
+        _subscribe(ws, state)
+
+        # Notify the sender that the receiver has connected
+        _send_to_peer(code, 'sender', MSG_RECEIVER_JOINED)
+
+        # Confirm connection with the receiver
+        ws.send(MSG_WAITING_FOR_FILE)
+        logger.debug("Receiver connected to room: %s", code)
+    else:
+        # Inform the client if the code is invalid or the room is full
+        ws.send(ERR_INVALID_CODE)
+
+
+# O(1) dispatch on the message type; new message types just add an entry
+# here instead of growing an if/elif chain in the receive loop.
+HANDLERS = {
+    'register_sender': _handle_register_sender,
+    'register_receiver': _handle_register_receiver,
+}
+
 
 @sock.route('/ws')
 def websocket(ws):
     """Handles all WebSocket connections and messaging."""
-    print("WebSocket connection established.")
-    my_code = None
-    my_role = None
-    
+    logger.debug("WebSocket connection established.")
+    state = ConnState()
+
     try:
         while True:
             # Wait for a message from the client
@@ -45,115 +396,150 @@ def websocket(ws):
             if not data:
                 continue
 
-            message = json.loads(data)
-            msg_type = message.get('type')
-
-            # --- Sender Logic ---
-            if msg_type == 'register_sender':
-                my_role = 'sender'
-                my_code = generate_code()
-                rooms[my_code] = {
-                    'sender': ws,
-                    'receiver': None,
-                    'filename': None,
-                    'file_data': None
-                }
-                # Send the generated code back to the sender's browser
-                ws.send(json.dumps({'type': 'code_generated', 'code': my_code}))
-                print(f"Sender registered with code: {my_code}")
-
-            # --- Receiver Logic ---
-            elif msg_type == 'register_receiver':
-                code = message.get('code', '').upper()
-                if code in rooms and not rooms[code]['receiver']:
-                    my_role = 'receiver'
-                    my_code = code
-                    rooms[my_code]['receiver'] = ws
-                    
-                    # Notify the sender that the receiver has connected
-                    sender_ws = rooms[my_code].get('sender')
-                    if sender_ws:
-                        sender_ws.send(json.dumps({'type': 'receiver_joined'}))
-                    
-                    # Confirm connection with the receiver
-                    ws.send(json.dumps({'type': 'wating_for_file'}))
-                    print(f"Receiver connected to room: {my_code}")
-                else:
-                    # Inform the client if the code is invalid or the room is full
-                    ws.send(json.dumps({'type': 'error', 'message': 'Invalid or expired code.'}))
+            # The client sends binary frames, so data arrives as bytes and
+            # orjson parses it in place — no str decode pass first.
+            message = orjson.loads(data)
+            handler = HANDLERS.get(message.get('type'))
+            if handler:
+                handler(ws, message, state)
 
     except Exception as e:
-        print(f"WebSocket error: {e}")
+        logger.warning("WebSocket error: %s", e)
     finally:
         # --- Cleanup Logic ---
         # When a connection closes (or an error occurs), clean up the room
-        if my_code and my_code in rooms:
-            print(f"Cleaning up room: {my_code} due to {my_role} disconnect.")
-            
-            # If the sender disconnects, notify the receiver
-            if my_role == 'sender' and rooms[my_code].get('receiver'):
-                try:
-                    rooms[my_code]['receiver'].send(json.dumps({'type': 'error', 'message': 'Sender disconnected.'}))
-                except:
-                    pass # Receiver might already be disconnected
-            
-            # If the receiver disconnects, notify the sender
-            elif my_role == 'receiver' and rooms[my_code].get('sender'):
-                try:
-                     rooms[my_code]['sender'].send(json.dumps({'type': 'error', 'message': 'Receiver disconnected.'}))
-                except:
-                    pass # Sender might already be disconnected
-
-            del rooms[my_code]
-            print(f"Room {my_code} has been closed.")
-        
-        print("WebSocket connection closed.")
+        if state.code:
+            logger.debug("Cleaning up room: %s due to %s disconnect.",
+                         state.code, state.role)
+
+            # Notify the other side of the room, wherever it is connected
+            try:
+                if state.role == 'sender':
+                    _send_to_peer(state.code, 'receiver', ERR_SENDER_DISCONNECTED)
+                elif state.role == 'receiver':
+                    _send_to_peer(state.code, 'sender', ERR_RECEIVER_DISCONNECTED)
+            except Exception:
+                pass # The peer might already be disconnected
+
+            _drop_room(state.code)
+            logger.debug("Room %s has been closed.", state.code)
+
+        if state.pubsub:
+            state.pubsub.close()
+
+        logger.debug("WebSocket connection closed.")
 
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """Handles the file upload from the sender."""
-    code = request.form.get('code')
-    if 'file' not in request.files or not code or code not in rooms:
+    code = request.args.get('code')
+    if not code or code not in rooms:
         return 'Invalid request', 400
 
-    file = request.files['file']
-    if file.filename == '':
+    filename = request.headers.get('X-Filename')
+    if not filename:
         return 'No selected file', 400
+    # The client percent-encodes the name: HTTP headers only carry
+    # latin-1, which made uploads with e.g. CJK filenames fail outright.
+    filename = unquote(filename)
 
-    # Store file data in memory
-    file_data = file.read()
-    rooms[code]['filename'] = file.filename
-    rooms[code]['file_data'] = file_data
-    
-    # Notify the receiver that the file is ready for download
-    receiver_ws = rooms[code].get('receiver')
-    if receiver_ws:
-        receiver_ws.send(json.dumps({
-            'type': 'file_ready', 
-            'filename': file.filename, 
-            'filesize': len(file_data)
-        }))
-        return 'File uploaded and receiver notified.', 200
-    else:
+    room = rooms[code]
+    receiver_ws = room.receiver
+    if not receiver_ws:
         return 'Receiver not connected.', 400
 
+    size = request.content_length
+    # Only a missing Content-Length is invalid; an empty file legitimately
+    # posts with size 0 and the presized-buffer path handles it fine.
+    if size is None:
+        return 'Invalid request', 400
+
+    room.filename = filename
+
+    if size > SPILL_THRESHOLD:
+        # Too big for RAM: stream the body to a local tmpfile and remember
+        # the path. The file is unlinked when the room is cleaned up.
+        tmp = tempfile.NamedTemporaryFile(delete=False, dir=SPILL_DIR,
+                                          prefix='peerdrop-')
+        try:
+            shutil.copyfileobj(request.stream, tmp, CHUNK_SIZE)
+        except BaseException:
+            # Client aborted mid-upload. file_path was never set, so no
+            # cleanup path would ever see this file — unlink it now.
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+        tmp.close()
+        room.file_path = tmp.name
+    else:
+        # The raw-body upload always carries Content-Length, so grab a
+        # (possibly recycled) buffer big enough up front and write chunks
+        # into it through a memoryview — no intermediate bytes objects and
+        # no reallocation growth as the file streams in.
+        buf, cls = _acquire_buffer(size)
+        mv = memoryview(buf)
+        offset = 0
+        while chunk := request.stream.read(CHUNK_SIZE):
+            mv[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+        room.file_data = buf
+        room.file_size = size
+        room.buf_cls = cls
+
+    # Notify the receiver that the file is ready for download
+    receiver_ws.send(orjson.dumps({
+        'type': 'file_ready',
+        'filename': filename,
+        'filesize': size
+    }))
+    return 'File uploaded and receiver notified.', 200
+
 
 @app.route('/download')
 def download_file():
-    """Serves the file to the receiver for download."""
+    """Streams the file to the receiver for download."""
     code = request.args.get('code')
     if not code or code not in rooms:
         return 'Invalid download link.', 400
-    
+
     room = rooms.get(code)
-    if room and room.get('file_data') is not None:
-        # Serve the file from memory
+    if room and room.file_path:
+        if ACCEL_PREFIX:
+            # Hand the transfer to nginx: we return only headers and nginx
+            # serves the spilled file itself with kernel sendfile.
+            resp = Response(mimetype='application/octet-stream')
+            resp.headers['X-Accel-Redirect'] = (
+                f'{ACCEL_PREFIX}/{os.path.basename(room.file_path)}'
+            )
+            _set_attachment_header(resp, room.filename)
+            return resp
+        # Spilled to disk: send_file goes through wsgi.file_wrapper, so the
+        # server can use a sendfile-style fast path instead of shuttling
+        # chunks through Python.
         return send_file(
-            io.BytesIO(room['file_data']),
+            room.file_path,
             as_attachment=True,
-            download_name=room['filename']
+            download_name=room.filename
         )
+    if room and room.file_data is not None:
+        # Hand out the in-memory buffer as memoryview windows: zero-copy
+        # (no BytesIO wrapper, which would duplicate the bytearray) and no
+        # send_file overhead — in particular no etag pass hashing the whole
+        # payload. Writing in 64 KiB slices instead of one giant body also
+        # lets the greenlet yield between socket writes.
+        # Pooled buffers are sized up to their class, so serve only the
+        # file_size prefix that the upload actually filled. The generator
+        # also ref-counts the buffer so room teardown cannot recycle it
+        # under a response that is still streaming.
+        resp = Response(
+            _stream_room_buffer(room),
+            mimetype='application/octet-stream',
+            direct_passthrough=True
+        )
+        _set_attachment_header(resp, room.filename)
+        resp.headers['Content-Length'] = str(room.file_size)
+        return resp
     else:
         return 'File not found or link expired.', 404
 
@@ -166,18 +552,9 @@ HTML_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>PeerDrop - Simple File Sharing</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap" rel="stylesheet">
-    <style>
-        body { font-family: 'Inter', sans-serif; }
-        .tab-button.active {
-            background-color: #4f46e5;
-            color: white;
-        }
-        .code-display {
-            letter-spacing: 0.25em;
-        }
-    </style>
+    <!-- Prebuilt local stylesheet: no CDN Tailwind compiler or webfont
+         fetch, so first paint needs no third-party connections. -->
+    <link rel="stylesheet" href="/static/app.css">
 </head>
 <body class="bg-gray-100 flex items-center justify-center min-h-screen">
 
@@ -213,7 +590,7 @@ HTML_TEMPLATE = """
 
         <!-- Receive Panel -->
         <div id="receive-panel" class="hidden space-y-4">
-            <input type="text" id="code-input" placeholder="Enter 5-digit code" class="w-full text-center p-3 border-2 border-gray-300 rounded-lg focus:ring-2 focus:ring-indigo-500 focus:border-indigo-500 text-2xl uppercase code-display" maxlength="5">
+            <input type="text" id="code-input" placeholder="Enter 6-digit code" class="w-full text-center p-3 border-2 border-gray-300 rounded-lg focus:ring-2 focus:ring-indigo-500 focus:border-indigo-500 text-2xl uppercase code-display" maxlength="6">
             <button id="receive-btn" class="w-full bg-indigo-600 text-white font-bold py-3 px-4 rounded-lg hover:bg-indigo-700 focus:outline-none focus:ring-2 focus:ring-offset-2 focus:ring-indigo-500 transition-transform duration-200 active:scale-95">
                 Receive
             </button>
@@ -252,11 +629,20 @@ HTML_TEMPLATE = """
         let ws;
         let myCode = null;
         let isSender = true;
+        const wsEncoder = new TextEncoder();
+
+        // Send as a binary frame so the server can parse the bytes
+        // directly instead of decoding a text frame first.
+        function wsSend(msg) {
+            ws.send(wsEncoder.encode(JSON.stringify(msg)));
+        }
 
         // --- WebSocket Logic ---
         function connectWebSocket() {
             const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
             ws = new WebSocket(`${protocol}//${window.location.host}/ws`);
+            // Server messages arrive as binary JSON frames
+            ws.binaryType = 'arraybuffer';
 
             ws.onopen = () => {
                 console.log('WebSocket connection opened.');
@@ -264,7 +650,10 @@ HTML_TEMPLATE = """
             };
 
             ws.onmessage = (event) => {
-                const message = JSON.parse(event.data);
+                const raw = typeof event.data === 'string'
+                    ? event.data
+                    : new TextDecoder().decode(event.data);
+                const message = JSON.parse(raw);
                 console.log('Received message:', message);
                 handleServerMessage(message);
             };
@@ -377,29 +766,31 @@ HTML_TEMPLATE = """
             }
             sendBtn.disabled = true;
             statusDisplay.textContent = 'Generating code...';
-            ws.send(JSON.stringify({ type: 'register_sender' }));
+            wsSend({ type: 'register_sender' });
         });
         
         receiveBtn.addEventListener('click', () => {
             const code = codeInput.value.trim().toUpperCase();
-            if (code.length !== 5) {
-                statusDisplay.textContent = 'Please enter a valid 5-digit code.';
+            if (code.length !== 6) {
+                statusDisplay.textContent = 'Please enter a valid 6-digit code.';
                 return;
             }
             statusDisplay.textContent = 'Connecting...';
-            ws.send(JSON.stringify({ type: 'register_receiver', code: code }));
+            wsSend({ type: 'register_receiver', code: code });
         });
         
         // --- File Upload ---
         function uploadFile() {
             const file = fileInput.files[0];
-            const formData = new FormData();
-            formData.append('file', file);
-            formData.append('code', myCode);
 
-            fetch('/upload', {
+            // Post the file as the raw request body; the server reads it
+            // straight off the wire without multipart parsing.
+            fetch(`/upload?code=${myCode}`, {
                 method: 'POST',
-                body: formData
+                body: file,
+                // Percent-encode: header values can't carry characters
+                // above U+00FF, which would reject e.g. CJK filenames
+                headers: { 'X-Filename': encodeURIComponent(file.name) }
             })
             .then(response => {
                 if (response.ok) {
@@ -424,9 +815,28 @@ HTML_TEMPLATE = """
 </html>
 """
 
+# Precompiled at import time: the raw page bytes, a gzipped copy for clients
+# that accept it (~5x fewer wire bytes), and an ETag for the 304 fast path.
+_HTML_BYTES = HTML_TEMPLATE.encode('utf-8')
+_HTML_GZ = gzip.compress(_HTML_BYTES, 9)
+_HTML_ETAG = hashlib.md5(_HTML_BYTES).hexdigest()
+
 if __name__ == '__main__':
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIServer
+
     # Get port from environment variable or default to 5000
     port = int(os.environ.get('PORT', 5000))
-    # Running with debug=False is recommended for production
+    # gevent's server handles every connection in its own greenlet — a few
+    # KB each rather than an OS thread stack — so thousands of idle rooms
+    # cost almost nothing. The bounded pool caps concurrent connections so
+    # a flood degrades to queueing at accept() instead of exhausting RAM.
+    # flask_sock performs the WebSocket upgrade itself under gevent, so no
+    # special handler_class is needed (and adding one breaks the handshake
+    # by upgrading the connection twice).
+    max_connections = int(os.environ.get('PEERDROP_MAX_CONNECTIONS', 1000))
     # Use '0.0.0.0' to make it accessible on your network
-    app.run(host='0.0.0.0', port=port, debug=True)
+    server = WSGIServer(('0.0.0.0', port), app,
+                        spawn=Pool(max_connections))
+    logger.info("Serving on port %s...", port)
+    server.serve_forever()